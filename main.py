@@ -4,10 +4,15 @@ import os
 import io
 import sqlite3
 import asyncio
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Optional, Dict, Any, Tuple
 from dotenv import load_dotenv
 from PIL import Image
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 
 load_dotenv()
@@ -15,10 +20,43 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 DB_PATH = os.environ.get("BOT_DB") or "bot_data.sqlite3"
 LOGO_SIZE = (300, 300)  # desired thumbnail size (Telegram prefers small jpgs)
 
+# --- static reply texts ---
+_START_TEXT = (
+    "سلام ☕️\n"
+    "ربات موزیک کافه — تنظیمات کانال‌ها را اضافه کن و بعد آهنگ بفرست تا منتشر شود.\n\n"
+    "دستورها: /help"
+)
+_HELP_TEXT = (
+    "راهنما:\n"
+    "/addchannel <@channel یا -100...> [اسم_کافه] — اضافه کردن کانال\n"
+    "/listchannels — لیست کانال‌های شما\n"
+    "/setdefault <channel_db_id> — تنظیم کانال پیش‌فرض\n"
+    "/setname <channel_db_id> <نام> — تنظیم اسم کافه برای کانال\n"
+    "/setcaption <channel_db_id> <متن> — تنظیم کپشن\n"
+    "/setlogo <channel_db_id> — سپس یک عکس بفرست تا لوگو ذخیره شود\n\n"
+    "پس از تنظیم حداقل یک کانال: فقط آهنگ بفرست؛ اگر بیش از یک کانال داشته باشی و کانال پیش‌فرض تعیین نکرده باشی، ربات ازت می‌پرسد کدام کانال."
+)
+_USAGE_ADDCHANNEL = "Usage: /addchannel <@channel یا -100...> [اسم_کافه]"
+_INVALID_ID_TEXT = "آیدی صحیح نیست."
+
 # --- DB helpers using run_in_executor to avoid blocking loop ---
+# single long-lived connection (keeps sqlite page cache warm), owned by one dedicated
+# worker thread: every DB call runs there, so calls are serialized without extra locking
+DB: Optional[sqlite3.Connection] = None
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+    # open the connection on the DB thread so it never crosses threads
+    _db_executor.submit(_init_db).result()
+
+def _init_db():
+    global DB
+    DB = sqlite3.connect(DB_PATH, isolation_level=None)
+    DB.execute("PRAGMA journal_mode=WAL")
+    DB.execute("PRAGMA temp_store=memory")
+    DB.execute("PRAGMA synchronous=normal")
+    DB.execute("PRAGMA cache_size=-64000")
+    cur = DB.cursor()
     cur.execute("""
     CREATE TABLE IF NOT EXISTS channels (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -26,7 +64,6 @@ def init_db():
         channel_id TEXT NOT NULL,
         cafe_name TEXT,
         caption TEXT,
-        logo BLOB,
         is_default INTEGER DEFAULT 0,
         UNIQUE(user_id, channel_id)
     );""")
@@ -39,126 +76,234 @@ def init_db():
         file_name TEXT,
         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
     );""")
-    conn.commit()
-    conn.close()
+    # logos live in their own table so metadata reads stay on small pages
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS channel_logos (
+        channel_db_id INTEGER PRIMARY KEY REFERENCES channels(id),
+        logo BLOB
+    );""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_channels_user ON channels(user_id, is_default DESC, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_songs_user_ts ON songs(user_id, timestamp)")
+    # migrate logos from the old channels.logo column
+    if any(col[1] == "logo" for col in cur.execute("PRAGMA table_info(channels)")):
+        cur.execute("BEGIN")
+        cur.execute("INSERT OR IGNORE INTO channel_logos(channel_db_id, logo) SELECT id, logo FROM channels WHERE logo IS NOT NULL")
+        cur.execute("ALTER TABLE channels DROP COLUMN logo")
+        cur.execute("COMMIT")
 
 async def db_execute(query: str, args: tuple = ()):
     loop = asyncio.get_running_loop()
     def _do():
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute(query, args)
-        conn.commit()
-        rowid = cur.lastrowid
-        conn.close()
-        return rowid
-    return await loop.run_in_executor(None, _do)
+        # autocommit (isolation_level=None): no explicit commit needed
+        return DB.execute(query, args).lastrowid
+    return await loop.run_in_executor(_db_executor, _do)
 
 async def db_query_one(query: str, args: tuple = ()):
     loop = asyncio.get_running_loop()
-    def _do():
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute(query, args)
-        r = cur.fetchone()
-        conn.close()
-        return r
-    return await loop.run_in_executor(None, _do)
+    return await loop.run_in_executor(_db_executor, lambda: DB.execute(query, args).fetchone())
 
 async def db_query_all(query: str, args: tuple = ()):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, lambda: DB.execute(query, args).fetchall())
+
+async def db_transaction(fn):
+    # run fn(DB) as one transaction in a single executor hop
     loop = asyncio.get_running_loop()
     def _do():
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute(query, args)
-        r = cur.fetchall()
-        conn.close()
+        DB.execute("BEGIN")
+        try:
+            r = fn(DB)
+        except:
+            DB.execute("ROLLBACK")
+            raise
+        DB.execute("COMMIT")
         return r
-    return await loop.run_in_executor(None, _do)
+    return await loop.run_in_executor(_db_executor, _do)
 
 # --- image helper (in-memory, returns BytesIO jpg) ---
-def resize_image_bytes(img_bytes: bytes, size: Tuple[int,int]=LOGO_SIZE) -> io.BytesIO:
-    img = Image.open(io.BytesIO(img_bytes))
-    img = img.convert("RGB")
-    img.thumbnail(size)
+def resize_image_bytes(src: io.BytesIO, size: Tuple[int,int]=LOGO_SIZE) -> io.BytesIO:
+    img = Image.open(src)
+    if img.format == "JPEG" and img.mode == "RGB" and img.size[0] <= size[0] and img.size[1] <= size[1]:
+        # already a small RGB jpg: reuse the original bytes, skip decode + re-encode
+        src.seek(0)
+        src.name = "logo.jpg"
+        return src
+    if img.format == "JPEG":
+        # let libjpeg downscale (1/2, 1/4, 1/8) while decoding; finish with bicubic
+        img.draft("RGB", size)
+        img = img.convert("RGB")
+        img.thumbnail(size, Image.BICUBIC)
+    else:
+        img = img.convert("RGB")
+        img.thumbnail(size, reducing_gap=2.0)
     out = io.BytesIO()
-    img.save(out, format="JPEG", quality=85)
+    img.save(out, format="JPEG", quality=80, optimize=False, progressive=False, subsampling=2)
     out.seek(0)
     out.name = "logo.jpg"
     return out
 
+# --- small LRU of channel rows used when posting (channel_db_id -> row) ---
+CHANNEL_CACHE_SIZE = 256
+channel_cache: "OrderedDict[int, tuple]" = OrderedDict()
+
+def channel_cache_get(channel_db_id: int):
+    rec = channel_cache.get(channel_db_id)
+    if rec is not None:
+        channel_cache.move_to_end(channel_db_id)
+    return rec
+
+def channel_cache_put(channel_db_id: int, rec: tuple):
+    channel_cache[channel_db_id] = rec
+    channel_cache.move_to_end(channel_db_id)
+    if len(channel_cache) > CHANNEL_CACHE_SIZE:
+        channel_cache.popitem(last=False)
+
+def channel_cache_invalidate(channel_db_id: Optional[int]=None, user_id: Optional[int]=None):
+    if channel_db_id is not None:
+        channel_cache.pop(channel_db_id, None)
+    if user_id is not None:
+        for k in [k for k, rec in channel_cache.items() if rec[1] == user_id]:
+            del channel_cache[k]
+
 # --- CRUD helpers for channels ---
+# query strings kept as constants so sqlite3's statement cache is hit on every call
+_Q_UPSERT_LOGO = "INSERT INTO channel_logos(channel_db_id, logo) VALUES(?,?) ON CONFLICT(channel_db_id) DO UPDATE SET logo=excluded.logo"
+_Q_LIST_CHANNELS = "SELECT id, channel_id, cafe_name, caption, is_default FROM channels WHERE user_id=? ORDER BY id"
+_Q_CHANNEL = "SELECT id, user_id, channel_id, cafe_name, caption, NULL, is_default FROM channels WHERE id=?"
+_Q_CHANNEL_WITH_LOGO = ("SELECT c.id, c.user_id, c.channel_id, c.cafe_name, c.caption, l.logo, c.is_default "
+                        "FROM channels c LEFT JOIN channel_logos l ON l.channel_db_id=c.id WHERE c.id=?")
+# (channel count, id to post to without asking: the default channel, else the only channel)
+_Q_COUNT_AND_TARGET = ("SELECT COUNT(*), COALESCE((SELECT id FROM channels WHERE user_id=? AND is_default=1 LIMIT 1), "
+                       "CASE WHEN COUNT(*)=1 THEN MIN(id) END) FROM channels WHERE user_id=?")
+_Q_DEFAULT = ("SELECT c.id, c.channel_id, c.cafe_name, c.caption, l.logo "
+              "FROM channels c LEFT JOIN channel_logos l ON l.channel_db_id=c.id WHERE c.user_id=? AND c.is_default=1")
+
 async def add_or_update_channel(user_id: int, channel_id: str, cafe_name: Optional[str]=None, caption: Optional[str]=None, logo_bytes: Optional[bytes]=None, make_default: bool=False):
-    # insert or update; store logo as blob if provided
-    existing = await db_query_one("SELECT id FROM channels WHERE user_id=? AND channel_id=?", (user_id, channel_id))
-    if existing:
-        q = "UPDATE channels SET cafe_name = COALESCE(?, cafe_name), caption = COALESCE(?, caption) WHERE id=?"
-        await db_execute(q, (cafe_name, caption, existing[0]))
-        if logo_bytes:
-            await db_execute("UPDATE channels SET logo=? WHERE id=?", (logo_bytes, existing[0]))
-        if make_default:
-            await db_execute("UPDATE channels SET is_default=0 WHERE user_id=?", (user_id,))
-            await db_execute("UPDATE channels SET is_default=1 WHERE id=?", (existing[0],))
-        return existing[0]
-    else:
+    # update if present, else insert (a plain upsert would burn an AUTOINCREMENT id on every update,
+    # leaving gaps in the user-facing db_id); store logo as blob if provided
+    def _do(conn: sqlite3.Connection):
         if make_default:
-            await db_execute("UPDATE channels SET is_default=0 WHERE user_id=?", (user_id,))
-            is_def = 1
+            conn.execute("UPDATE channels SET is_default=0 WHERE user_id=?", (user_id,))
+        q = ("UPDATE channels SET cafe_name = COALESCE(?, cafe_name), caption = COALESCE(?, caption), "
+             "is_default = CASE WHEN ?=1 THEN 1 ELSE is_default END "
+             "WHERE user_id=? AND channel_id=? RETURNING id")
+        rows = conn.execute(q, (cafe_name, caption, int(make_default), user_id, channel_id)).fetchall()
+        if rows:
+            rowid = rows[0][0]
         else:
-            is_def = 0
-        q = "INSERT INTO channels(user_id, channel_id, cafe_name, caption, logo, is_default) VALUES(?,?,?,?,?,?)"
-        rowid = await db_execute(q, (user_id, channel_id, cafe_name, caption, logo_bytes, is_def))
+            q = "INSERT INTO channels(user_id, channel_id, cafe_name, caption, is_default) VALUES(?,?,?,?,?)"
+            rowid = conn.execute(q, (user_id, channel_id, cafe_name, caption, int(make_default))).lastrowid
+        if logo_bytes:
+            conn.execute(_Q_UPSERT_LOGO, (rowid, logo_bytes))
         return rowid
+    rowid = await db_transaction(_do)
+    channel_cache_invalidate(rowid, user_id if make_default else None)
+    return rowid
 
 async def list_channels_of_user(user_id: int):
-    rows = await db_query_all("SELECT id, channel_id, cafe_name, caption, is_default FROM channels WHERE user_id=?", (user_id,))
+    rows = await db_query_all(_Q_LIST_CHANNELS, (user_id,))
     return rows
 
-async def get_channel_by_dbid(channel_db_id: int):
-    return await db_query_one("SELECT id, user_id, channel_id, cafe_name, caption, logo, is_default FROM channels WHERE id=?", (channel_db_id,))
+async def channel_count_and_default(user_id: int) -> Tuple[int, Optional[int]]:
+    count, target_id = await db_query_one(_Q_COUNT_AND_TARGET, (user_id, user_id))
+    return count, target_id
+
+async def get_channel_by_dbid(channel_db_id: int, with_logo: bool=False):
+    # row shape is always (id, user_id, channel_id, cafe_name, caption, logo, is_default);
+    # logo is only read (and non-NULL) when with_logo=True
+    return await db_query_one(_Q_CHANNEL_WITH_LOGO if with_logo else _Q_CHANNEL, (channel_db_id,))
 
 async def get_default_channel(user_id: int):
-    return await db_query_one("SELECT id, channel_id, cafe_name, caption, logo FROM channels WHERE user_id=? AND is_default=1", (user_id,))
+    return await db_query_one(_Q_DEFAULT, (user_id,))
+
+async def set_channel_logo(channel_db_id: int, logo_bytes: bytes):
+    await db_execute(_Q_UPSERT_LOGO, (channel_db_id, logo_bytes))
+    channel_cache_invalidate(channel_db_id)
 
 async def set_default_channel(user_id: int, channel_db_id: int):
-    await db_execute("UPDATE channels SET is_default=0 WHERE user_id=?", (user_id,))
-    await db_execute("UPDATE channels SET is_default=1 WHERE id=?", (channel_db_id,))
+    await db_execute("UPDATE channels SET is_default=(id=?) WHERE user_id=?", (channel_db_id, user_id))
+    channel_cache_invalidate(user_id=user_id)
 
 # --- save song history ---
 async def record_song(user_id: int, channel_db_id: int, title: str, file_name: str):
     await db_execute("INSERT INTO songs(user_id, channel_db_id, title, file_name) VALUES(?,?,?,?)", (user_id, channel_db_id, title, file_name))
 
+# --- bounded per-user state: least recently set entries are evicted, entries expire after ttl seconds ---
+class TTLLRU:
+    def __init__(self, maxsize: int, ttl: float, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def _evict(self, value):
+        if self.on_evict:
+            self.on_evict(value)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self._data:
+            key, (ts, value) = next(iter(self._data.items()))
+            if ts > deadline:
+                break
+            del self._data[key]
+            self._evict(value)
+
+    def __setitem__(self, key, value):
+        old = self._data.pop(key, None)
+        if old is not None and old[1] is not value:
+            self._evict(old[1])
+        self._data[key] = (time.monotonic(), value)
+        self._expire()
+        while len(self._data) > self.maxsize:
+            self._evict(self._data.popitem(last=False)[1][1])
+
+    def __contains__(self, key) -> bool:
+        self._expire()
+        return key in self._data
+
+    def pop(self, key, default=None):
+        self._expire()
+        item = self._data.pop(key, None)
+        return item[1] if item is not None else default
+
+def discard_pending_file(pend: Optional[Dict[str, Any]]):
+    if pend:
+        try:
+            os.unlink(pend["path"])
+        except OSError:
+            pass
+
 # --- simple in-memory map for awaiting logo (user_id -> channel_db_id) ---
-awaiting_logo: Dict[int, int] = {}
-# --- temporary pending audio storage keyed by user (in memory, BytesIO) ---
+awaiting_logo = TTLLRU(256, 1800)
+# --- temporary pending audio storage keyed by user (temp file path on disk) ---
 # this is per-process; if process restarts, pending lost (but DB keeps channels)
-pending_audio: Dict[int, Dict[str, Any]] = {}
+# evicted/replaced entries have their temp file removed
+pending_audio = TTLLRU(256, 1800, on_evict=discard_pending_file)
+
+# --- channel-selection keyboards, memoized on the (id, channel_id, cafe_name) of the rows ---
+@lru_cache(maxsize=256)
+def _channel_markup(fingerprint: tuple) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"{chanid} ({name})" if name else chanid, callback_data=f"post:{dbid}")]
+        for dbid, chanid, name in fingerprint
+    ])
+
+def channel_keyboard(rows) -> InlineKeyboardMarkup:
+    return _channel_markup(tuple((r[0], r[1], r[2]) for r in rows))
 
 # --- bot commands / flows ---
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "سلام ☕️\n"
-        "ربات موزیک کافه — تنظیمات کانال‌ها را اضافه کن و بعد آهنگ بفرست تا منتشر شود.\n\n"
-        "دستورها: /help"
-    )
+    await update.message.reply_text(_START_TEXT)
 
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "راهنما:\n"
-        "/addchannel <@channel یا -100...> [اسم_کافه] — اضافه کردن کانال\n"
-        "/listchannels — لیست کانال‌های شما\n"
-        "/setdefault <channel_db_id> — تنظیم کانال پیش‌فرض\n"
-        "/setname <channel_db_id> <نام> — تنظیم اسم کافه برای کانال\n"
-        "/setcaption <channel_db_id> <متن> — تنظیم کپشن\n"
-        "/setlogo <channel_db_id> — سپس یک عکس بفرست تا لوگو ذخیره شود\n\n"
-        "پس از تنظیم حداقل یک کانال: فقط آهنگ بفرست؛ اگر بیش از یک کانال داشته باشی، ربات ازت می‌پرسد کدام کانال."
-    )
+    await update.message.reply_text(_HELP_TEXT)
 
 async def cmd_addchannel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     args = context.args
     if not args:
-        return await update.message.reply_text("Usage: /addchannel <@channel یا -100...> [اسم_کافه]")
+        return await update.message.reply_text(_USAGE_ADDCHANNEL)
     channel_id = args[0]
     cafe_name = " ".join(args[1:]) if len(args) > 1 else None
     rowid = await add_or_update_channel(user_id, channel_id, cafe_name=cafe_name)
@@ -182,7 +327,7 @@ async def cmd_setdefault(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         dbid = int(context.args[0])
     except:
-        return await update.message.reply_text("آیدی صحیح نیست.")
+        return await update.message.reply_text(_INVALID_ID_TEXT)
     await set_default_channel(user_id, dbid)
     await update.message.reply_text("✅ کانال پیش‌فرض تنظیم شد.")
 
@@ -192,9 +337,10 @@ async def cmd_setname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         dbid = int(context.args[0])
     except:
-        return await update.message.reply_text("آیدی صحیح نیست.")
+        return await update.message.reply_text(_INVALID_ID_TEXT)
     name = " ".join(context.args[1:])
     await db_execute("UPDATE channels SET cafe_name=? WHERE id=?", (name, dbid))
+    channel_cache_invalidate(dbid)
     await update.message.reply_text("✅ نام کافه تنظیم شد.")
 
 async def cmd_setcaption(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -203,9 +349,10 @@ async def cmd_setcaption(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         dbid = int(context.args[0])
     except:
-        return await update.message.reply_text("آیدی صحیح نیست.")
+        return await update.message.reply_text(_INVALID_ID_TEXT)
     cap = " ".join(context.args[1:])
     await db_execute("UPDATE channels SET caption=? WHERE id=?", (cap, dbid))
+    channel_cache_invalidate(dbid)
     await update.message.reply_text("✅ کپشن تنظیم شد.")
 
 async def cmd_setlogo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -215,7 +362,7 @@ async def cmd_setlogo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         dbid = int(context.args[0])
     except:
-        return await update.message.reply_text("آیدی صحیح نیست.")
+        return await update.message.reply_text(_INVALID_ID_TEXT)
     # check ownership
     rec = await get_channel_by_dbid(dbid)
     if not rec or rec[1] != user_id:
@@ -229,10 +376,13 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         dbid = awaiting_logo.pop(user_id)
         # get largest photo
         file = await update.message.photo[-1].get_file()
-        img_bytes = await file.download_as_bytearray()
-        resized = resize_image_bytes(bytes(img_bytes))
+        img_buf = io.BytesIO()
+        await file.download_to_memory(out=img_buf)
+        img_buf.seek(0)
+        # decode/resize/encode off the event loop
+        resized = await asyncio.get_running_loop().run_in_executor(None, resize_image_bytes, img_buf)
         # store blob in DB
-        await db_execute("UPDATE channels SET logo=? WHERE id=?", (resized.read(), dbid))
+        await set_channel_logo(dbid, resized.getvalue())
         await update.message.reply_text("✅ لوگو ذخیره شد و برای آن کانال اعمال می‌شود.")
     else:
         await update.message.reply_text("اگر می‌خواهی لوگو ست کنی، ابتدا از /setlogo <channel_db_id> استفاده کن.")
@@ -243,36 +393,35 @@ async def audio_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     audio_msg = update.message.audio or update.message.voice or (update.message.document if update.message.document and (update.message.document.mime_type or "").startswith("audio") else None)
     if not audio_msg:
         return await update.message.reply_text("فایل صوتی شناسایی نشد.")
-    # download audio into memory
-    f = await audio_msg.get_file()
-    data = await f.download_as_bytearray()
-    buf = io.BytesIO(data)
     # set some metadata
     file_name = getattr(audio_msg, "file_name", None) or getattr(audio_msg, "title", None) or "track"
-    buf.name = file_name
-    # store pending audio in memory for user
+    # download audio to a temp file (keeps large files out of memory)
+    f = await audio_msg.get_file()
+    tmp = tempfile.NamedTemporaryFile(suffix=os.path.splitext(file_name)[1] or ".mp3", delete=False)
+    tmp.close()
+    try:
+        await f.download_to_drive(tmp.name)
+    except:
+        os.unlink(tmp.name)
+        raise
+    # store pending audio for user (replacing any earlier, unposted one)
     pending_audio[user_id] = {
-        "buf": buf,
+        "path": tmp.name,
         "title": getattr(audio_msg, "title", file_name),
-        "file_name": buf.name
+        "file_name": file_name
     }
-    # fetch user's channels
-    rows = await list_channels_of_user(user_id)
-    if not rows:
+    # cheap probe first; only list channels when we have to ask
+    count, target_id = await channel_count_and_default(user_id)
+    if count == 0:
+        discard_pending_file(pending_audio.pop(user_id))
         return await update.message.reply_text("ابتدا حداقل یک کانال اضافه کن: /addchannel")
-    if len(rows) == 1:
-        # directly post to single channel
-        chan_db_id = rows[0][0]
-        await do_post_audio_for_user_channel(update, context, user_id, chan_db_id)
+    if target_id is not None:
+        # directly post to the single / default channel
+        await do_post_audio_for_user_channel(update, context, user_id, target_id)
     else:
         # present inline keyboard to choose channel
-        buttons = []
-        for r in rows:
-            dbid, chanid, name, caption, is_def = r[0], r[1], r[2] or "", r[3] or "", r[4]
-            label = f"{chanid} ({name})" if name else chanid
-            buttons.append([InlineKeyboardButton(label, callback_data=f"post:{dbid}")])
-        # also a default option if exists
-        await update.message.reply_text("کدام کانال را انتخاب می‌کنید؟", reply_markup=InlineKeyboardMarkup(buttons))
+        rows = await list_channels_of_user(user_id)
+        await update.message.reply_text("کدام کانال را انتخاب می‌کنید؟", reply_markup=channel_keyboard(rows))
 
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -287,9 +436,11 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         # ensure pending audio exists
         if user_id not in pending_audio:
             return await query.edit_message_text("فایل صوتی پیدا نشد؛ لطفاً دوباره فایل را ارسال کنید.")
-        await do_post_audio_for_user_channel(update, context, user_id, dbid)
-        # edit original inline message to confirm
-        await query.edit_message_text("در حال ارسال به کانال...")
+        # edit original inline message while the channel lookup + upload run
+        await asyncio.gather(
+            query.edit_message_text("در حال ارسال به کانال..."),
+            do_post_audio_for_user_channel(update, context, user_id, dbid),
+        )
 
 async def do_post_audio_for_user_channel(update_or_msg, context: ContextTypes.DEFAULT_TYPE, user_id: int, channel_db_id: int):
     pend = pending_audio.pop(user_id, None)
@@ -301,36 +452,41 @@ async def do_post_audio_for_user_channel(update_or_msg, context: ContextTypes.DE
         except:
             pass
         return
-    buf: io.BytesIO = pend["buf"]
+    try:
+        await _post_pending_audio(context, user_id, channel_db_id, pend)
+    finally:
+        discard_pending_file(pend)
+
+async def _post_pending_audio(context: ContextTypes.DEFAULT_TYPE, user_id: int, channel_db_id: int, pend: Dict[str, Any]):
     title = pend["title"]
     file_name = pend["file_name"]
     # fetch channel settings
-    rec = await get_channel_by_dbid(channel_db_id)
+    rec = channel_cache_get(channel_db_id)
+    if rec is None:
+        rec = await get_channel_by_dbid(channel_db_id, with_logo=True)
+        if rec:
+            channel_cache_put(channel_db_id, rec)
     if not rec:
         await context.bot.send_message(chat_id=user_id, text="کانال انتخابی یافت نشد.")
         return
     # rec: id, user_id, channel_id, cafe_name, caption, logo, is_default
     chan_db_id, owner_id, chan_id, cafe_name, caption, logo_blob, is_def = rec
     # ensure bot is member etc. We'll attempt and catch exceptions
-    # prepare buffers for upload: rewind buf
-    buf.seek(0)
     # prepare thumb
-    thumb_buf = None
-    if logo_blob:
-        thumb_buf = io.BytesIO(logo_blob)
-        thumb_buf.name = "logo.jpg"
-        thumb_buf.seek(0)
+    thumb = InputFile(logo_blob, filename="logo.jpg", attach=True) if logo_blob else None
     # performer will be channel_id as requested
     performer = chan_id
     try:
-        await context.bot.send_audio(
-            chat_id=chan_id,
-            audio=buf,
-            title=title,
-            performer=performer,
-            thumbnail=thumb_buf,
-            caption=caption or ""
-        )
+        with open(pend["path"], "rb") as audio_file:
+            await context.bot.send_audio(
+                chat_id=chan_id,
+                audio=audio_file,
+                filename=file_name,
+                title=title,
+                performer=performer,
+                thumbnail=thumb,
+                caption=caption or ""
+            )
         # record history
         await record_song(user_id, channel_db_id, title, file_name)
         await context.bot.send_message(chat_id=user_id, text=f"✅ آهنگ در {chan_id} منتشر شد.")